@@ -23,6 +23,7 @@ export default function ProcessPage() {
   const [overrideMinutes, setOverrideMinutes] = useState('')
   const [namingPenalty, setNamingPenalty] = useState('2')
   const [roundingMode, setRoundingMode] = useState('none')
+  const [includeRaw, setIncludeRaw] = useState(false)
   const [exemptions, setExemptions] = useState({})
   const [busy, setBusy] = useState(false)
   const [error, setError] = useState('')
@@ -43,6 +44,7 @@ export default function ProcessPage() {
         if (j.overrideMinutes !== undefined) setOverrideMinutes(j.overrideMinutes === null ? '' : String(j.overrideMinutes))
         if (j.namingPenalty !== undefined) setNamingPenalty(String(j.namingPenalty))
         if (j.roundingMode !== undefined) setRoundingMode(String(j.roundingMode))
+        if (j.includeRaw !== undefined) setIncludeRaw(Boolean(j.includeRaw))
         if (j.exemptions) setExemptions(j.exemptions)
       }
     } catch {}
@@ -57,11 +59,12 @@ export default function ProcessPage() {
         overrideMinutes: overrideMinutes === '' ? null : overrideMinutes,
         namingPenalty,
         roundingMode,
+        includeRaw,
         exemptions,
       }
       localStorage.setItem(PREF_KEY, JSON.stringify(payload))
     } catch {}
-  }, [threshold, bufferMinutes, breakMinutes, overrideMinutes, namingPenalty, roundingMode, exemptions])
+  }, [threshold, bufferMinutes, breakMinutes, overrideMinutes, namingPenalty, roundingMode, includeRaw, exemptions])
 
   useEffect(() => {
     let cancelled = false
@@ -128,6 +131,7 @@ export default function ProcessPage() {
       override_total_minutes: overrideMinutes ? parseFloat(overrideMinutes) : null,
       penalty_tolerance_minutes: parseFloat(namingPenalty || '0'),
       rounding_mode: roundingMode,
+      include_raw: includeRaw,
     }
 
     const fd = new FormData()
@@ -229,6 +233,12 @@ export default function ProcessPage() {
               <option value="ceil_both">Ceil attendance &amp; threshold</option>
             </select>
           </label>
+          <label>Raw Zoom CSV sheet
+            <select value={includeRaw ? 'include' : 'omit'} onChange={(e) => setIncludeRaw(e.target.value === 'include')}>
+              <option value="omit">Omit</option>
+              <option value="include">Include</option>
+            </select>
+          </label>
         </div>
       </div>
 
@@ -1,72 +1,58 @@
 import { HandlerEvent, HandlerResponse } from '@netlify/functions'
 import {
   badRequest,
-  cleanupFiles,
+  headerJson,
+  isPayloadTooLarge,
   jsonResponse,
+  parseJsonObject,
   parseMultipart,
+  payloadTooLarge,
   withCors,
 } from './shared.js'
-import {
-  processRequest,
-  extractKeysFromCsv,
-  bufferToBase64,
-} from './logic.js'
+import type { ExemptionsMap, ProcessParams } from './logic.js'
+import { extractKeysFromCsv } from './zoomCsv.js'
 
 export async function handleProcess(event: HandlerEvent): Promise<HandlerResponse> {
+  if (isPayloadTooLarge(event)) {
+    return payloadTooLarge()
+  }
   const { fields, files } = await parseMultipart(event)
   const zoomFile = files['zoom_csv']
   if (!zoomFile) {
-    await cleanupFiles(Object.values(files))
     return badRequest('zoom_csv file is required')
   }
   const rosterFile = files['roster']
-  const paramsJson = fields['params'] || '{}'
-  const exemptionsJson = fields['exemptions'] || '{}'
-  try {
-    let params: any
-    let exemptions: any
-    try {
-      params = JSON.parse(paramsJson)
-    } catch {
-      params = {}
-    }
-    try {
-      exemptions = JSON.parse(exemptionsJson)
-    } catch {
-      exemptions = {}
-    }
-    const result = await processRequest(zoomFile.path, rosterFile?.path ?? null, params, exemptions)
-    const buffer = result.buffer
-    const meta = result.meta
-    return withCors({
-      statusCode: 200,
-      isBase64Encoded: true,
-      body: bufferToBase64(buffer),
-      headers: {
-        'Content-Type':
-          'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        'Content-Disposition': `attachment; filename=${meta.output_xlsx}`,
-        'X-Zoom-Attendance-Meta': JSON.stringify(meta),
-      },
-    })
-  } finally {
-    await cleanupFiles(Object.values(files))
-  }
+  // Loaded on demand so /keys never pulls in ExcelJS or SheetJS.
+  const { processRequest, bufferToBase64 } = await import('./logic.js')
+  const params = parseJsonObject(fields['params']) as ProcessParams
+  const exemptions = parseJsonObject(fields['exemptions']) as ExemptionsMap
+  const result = await processRequest(zoomFile.data, rosterFile ?? null, params, exemptions)
+  const buffer = result.buffer
+  const meta = result.meta
+  return withCors({
+    statusCode: 200,
+    isBase64Encoded: true,
+    body: bufferToBase64(buffer),
+    headers: {
+      'Content-Type':
+        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+      'Content-Disposition': `attachment; filename=${meta.output_xlsx}`,
+      'X-Zoom-Attendance-Meta': headerJson(meta),
+    },
+  })
 }
 
 export async function handleKeys(event: HandlerEvent): Promise<HandlerResponse> {
+  if (isPayloadTooLarge(event)) {
+    return payloadTooLarge()
+  }
   const { files } = await parseMultipart(event)
   const zoomFile = files['zoom_csv']
   if (!zoomFile) {
-    await cleanupFiles(Object.values(files))
     return badRequest('zoom_csv file is required')
   }
-  try {
-    const items = await extractKeysFromCsv(zoomFile.path)
-    return jsonResponse(200, items)
-  } finally {
-    await cleanupFiles(Object.values(files))
-  }
+  const items = extractKeysFromCsv(zoomFile.data)
+  return jsonResponse(200, items, event)
 }
 
 export function handleHealth(): HandlerResponse {
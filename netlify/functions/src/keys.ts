@@ -1,5 +1,5 @@
 import { Handler } from '@netlify/functions'
-import { badRequest, methodNotAllowed, optionsResponse, withCors } from './shared.js'
+import { badRequest, methodNotAllowed, optionsResponse } from './shared.js'
 import { handleKeys } from './handlers.js'
 
 const handler: Handler = async (event) => {
@@ -17,11 +17,7 @@ const handler: Handler = async (event) => {
     return await handleKeys(event)
   } catch (err) {
     const message = err instanceof Error ? err.message : String(err)
-    return withCors({
-      statusCode: 400,
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ error: message }),
-    })
+    return badRequest(message)
   }
 }
 
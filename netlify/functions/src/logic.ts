@@ -1,20 +1,119 @@
-import { parse } from 'csv-parse/sync'
-import iconv from 'iconv-lite'
-import { Workbook, Worksheet } from 'exceljs'
-import { DateTime, Duration } from 'luxon'
-import { promises as fs } from 'fs'
+import { DataValidation, Fill, Workbook, Worksheet } from 'exceljs'
+import { DateTime } from 'luxon'
 import { extname } from 'path'
 import * as XLSX from 'xlsx'
+import { ParseCache, cachedParse, rememberName } from './shared.js'
+import {
+  EXCLUDE_NAME_PATTERNS,
+  WHITESPACE_RE,
+  ZoomRow,
+  detectColumns,
+  normaliseZoom,
+  parseCsv,
+  parseName,
+  shouldExclude,
+  zoomKey,
+} from './zoomCsv.js'
 
 const APP_FILE_DEFAULT = 'zoom_attendance_processed.xlsx'
-const EXCLUDE_NAME_PATTERNS = [
-  /^\s*meeting analytics from read\s*$/i,
-  /^\s*ta\s*$/i,
-  /^\s*saboor'?s fathom notetaker\s*$/i,
-  /^\s*hassaan khalid\s*$/i,
-]
+const WRITER_ENGINE = 'exceljs'
+const META_STRIP_RE = /^\^\s*|\s*\$/g
+const EXCLUDED_PATTERNS_META = EXCLUDE_NAME_PATTERNS.map((re) => re.source.replace(META_STRIP_RE, '')).join('; ')
+const ROUNDING_MODE_LABELS: Record<ProcessMeta['rounding_mode'], string> = {
+  none: 'None',
+  ceil_attendance: 'Ceil attendance only',
+  ceil_both: 'Ceil attendance & threshold',
+}
 
-const RECONNECT_OVERLAP_TOLERANCE_SECONDS = 2
+const RECONNECT_OVERLAP_TOLERANCE_MS = 2 * 1000
+const MS_PER_MINUTE = 60 * 1000
+const INTERVAL_SEARCH_MIN = 4
+const PARENTHESISED_RE = /\([^)]*\)/g
+const FIVE_DIGITS_RE = /\d{5}/g
+const SEPARATOR_RE = /[_-]/g
+const NON_ALPHA_RE = /[^a-z]+/g
+const FIVE_DIGIT_CELL_RE = /^\s*\d{5}\s*$/
+const ERP_IN_CELL_RE = /(\d{5})/
+const canonNameCache = new Map<string, string>()
+const ZOOM_DATETIME_PARSER = DateTime.buildFormatParser('M/d/yyyy, h:mm:ss a')
+const OVERRIDE_VALIDATION: DataValidation = {
+  type: 'list',
+  allowBlank: true,
+  formulae: ['"Present,Absent"'],
+}
+const NEEDS_REVIEW_FILL: Fill = { type: 'pattern', pattern: 'solid', fgColor: { argb: 'FFF59D' } }
+const SHEET_COLUMNS = {
+  Attendance: [
+    'Key',
+    'Zoom Names (raw)',
+    'Attended Minutes (RAW)',
+    'Threshold Minutes (RAW)',
+    'Attended Minutes (DECISION)',
+    'Threshold Minutes (DECISION)',
+    'Attendance Status',
+    'Naming Penalty',
+    'Issues',
+  ],
+  Issues: [
+    'Key',
+    'ERP',
+    'Name',
+    'Zoom Names (raw)',
+    'Match Source',
+    'Issue Detail',
+    'Intervals/Segments',
+    'Dual Devices?',
+    'Reconnects?',
+    'Reconnect Count',
+    'Ambiguous Name?',
+    'Total Minutes Counted (Union RAW)',
+    'Override Attendance',
+  ],
+  Reconnects: [
+    'Key',
+    'ERP',
+    'Name',
+    'Zoom Names (raw)',
+    'Event # (per student)',
+    'Disconnect Time',
+    'Reconnect Time',
+    'Gap (minutes)',
+    'Gap (seconds)',
+    'Gap Duration (hh:mm:ss)',
+    'Disconnect Raw Name',
+    'Reconnect Raw Name',
+    'Disconnect Join (raw)',
+    'Disconnect Leave (raw)',
+    'Reconnect Join (raw)',
+    'Reconnect Leave (raw)',
+  ],
+  Absent: [
+    'Key',
+    'ERP',
+    'Name',
+    'Zoom Names (raw)',
+    'Attended Minutes (DECISION)',
+    'Threshold Minutes (DECISION)',
+    'Shortfall Minutes (DECISION)',
+    'Dual Devices?',
+    'Reconnects?',
+    'Reconnect Count',
+    'Is Ambiguous?',
+    'Reason',
+    'Override (from Issues)',
+    'Final Status',
+  ],
+  Penalties: [
+    'Key',
+    'Zoom Names (raw)',
+    'Bad-Name Minutes',
+    'Bad-Name %',
+    'Penalty Tolerance (min)',
+    'Penalty Applied',
+  ],
+  Matches: ['Key', 'ERP', 'Name', 'Zoom Names (raw)', 'Match Source'],
+} as const
+const rosterRowsCache: ParseCache<RosterRow> = { kind: '', source: null, rows: [] }
 
 export interface ProcessParams {
   threshold_ratio?: number
@@ -23,6 +122,8 @@ export interface ProcessParams {
   override_total_minutes?: number | null
   penalty_tolerance_minutes?: number
   rounding_mode?: 'none' | 'ceil_attendance' | 'ceil_both'
+  include_raw?: boolean
+  compress_level?: number
 }
 
 export interface ProcessMeta {
@@ -36,6 +137,7 @@ export interface ProcessMeta {
   rounding_mode: 'none' | 'ceil_attendance' | 'ceil_both'
   roster_used: boolean
   total_class_minutes_source: string
+  engine: string
 }
 
 export interface ProcessPayload {
@@ -45,18 +147,16 @@ export interface ProcessPayload {
 
 export type ExemptionsMap = Record<string, Record<string, boolean>>
 
-export interface ExtractedKey {
-  key: string
-  erp: string | null
-  name: string
-  display: string
+export interface RosterUpload {
+  data: Buffer
+  filename: string
 }
 
-type Interval = { start: DateTime; end: DateTime }
+type Interval = { start: number; end: number }
 
 type SessionRecord = {
-  joinTs: DateTime | null
-  leaveTs: DateTime | null
+  joinTs: number | null
+  leaveTs: number | null
   joinRaw: string
   leaveRaw: string
   rawName: string
@@ -64,9 +164,9 @@ type SessionRecord = {
 
 type ReconnectEvent = {
   index: number
-  disconnectTs: DateTime | null
-  reconnectTs: DateTime | null
-  gap: Duration
+  disconnectTs: number | null
+  reconnectTs: number | null
+  gapMs: number
   disconnectSeg: SessionRecord | null
   reconnectSeg: SessionRecord | null
 }
@@ -86,7 +186,12 @@ type KeyAggregates = {
   sessionRecords: SessionRecord[]
 }
 
-type ZoomRow = Record<string, string>
+type ZoomSession = {
+  rawName: string
+  joinRaw: string
+  leaveRaw: string
+  duration: number
+}
 
 type RosterRow = {
   ERP: string
@@ -95,109 +200,25 @@ type RosterRow = {
   Email: string
 }
 
-function decodeBuffer(buffer: Buffer): { text: string; encoding: string } {
-  if (buffer.length === 0) {
-    return { text: '', encoding: 'utf8' }
-  }
-  const first = buffer[0]
-  const second = buffer[1]
-  if (first === 0xff && second === 0xfe) {
-    return { text: iconv.decode(buffer, 'utf16-le'), encoding: 'utf16le' }
-  }
-  if (first === 0xfe && second === 0xff) {
-    return { text: iconv.decode(buffer, 'utf16-be'), encoding: 'utf16be' }
-  }
-  if (buffer.slice(0, 3).equals(Buffer.from([0xef, 0xbb, 0xbf]))) {
-    return { text: iconv.decode(buffer, 'utf8'), encoding: 'utf8-sig' }
-  }
-  try {
-    return { text: iconv.decode(buffer, 'utf8'), encoding: 'utf8' }
-  } catch {
-    return { text: iconv.decode(buffer, 'latin1'), encoding: 'latin1' }
-  }
-}
-
-function detectDelimiter(sample: string): string {
-  const candidates = [',', ';', '\t']
-  const lines = sample.split(/\r?\n/).slice(0, 5)
-  let best = ','
-  let bestScore = -1
-  for (const cand of candidates) {
-    const counts = lines.map((ln) => (ln.includes(cand) ? ln.split(cand).length : 0))
-    const avg = counts.reduce((a, b) => a + b, 0) / (counts.length || 1)
-    if (avg > bestScore) {
-      best = cand
-      bestScore = avg
-    }
-  }
-  return best
-}
-
-function parseCsv(buffer: Buffer, opts?: { columns?: boolean }): { records: any[]; headers: string[] } {
-  const { text } = decodeBuffer(buffer)
-  const delim = detectDelimiter(text)
-  const records = parse(text, {
-    columns: opts?.columns ?? true,
-    skip_empty_lines: true,
-    delimiter: delim,
-    relax_column_count: true,
-    trim: true,
-  }) as any[]
-  const headers: string[] = Array.isArray(records) && records.length > 0 ? Object.keys(records[0]) : []
-  return { records, headers }
-}
-
-function parseZoomCsv(buffer: Buffer): ZoomRow[] {
-  const { text } = decodeBuffer(buffer)
-  const headerMatch = /\bName\s*\(original name\)\s*,/i.exec(text)
-  let payload = text
-  if (headerMatch) {
-    const idx = text.lastIndexOf('\n', headerMatch.index)
-    payload = text.slice(idx >= 0 ? idx + 1 : 0)
-  } else {
-    const lines = text.split(/\r?\n/).filter((ln) => ln.trim())
-    let headerIndex = -1
-    for (let i = 0; i < lines.length; i++) {
-      const low = lines[i].toLowerCase()
-      if (low.includes('join time') && low.includes('leave time')) {
-        headerIndex = i
-        break
-      }
-    }
-    if (headerIndex === -1) {
-      throw new Error('Could not locate the participants header row in the CSV.')
-    }
-    payload = lines.slice(headerIndex).join('\n')
-  }
-  const payloadBuffer = Buffer.from(payload, 'utf8')
-  const { records } = parseCsv(payloadBuffer)
-  return records as ZoomRow[]
-}
-
-function normaliseZoom(buffer: Buffer): ZoomRow[] {
-  return parseZoomCsv(buffer)
-}
-
 function parseDate(value: string | undefined): DateTime | null {
   if (!value) return null
   const trimmed = value.trim()
   if (!trimmed) return null
   const dt = DateTime.fromISO(trimmed, { zone: 'utc' })
   if (dt.isValid) return dt.toUTC()
-  const parsed = DateTime.fromFormat(trimmed, 'M/d/yyyy, h:mm:ss a', { zone: 'utc' })
+  const parsed = DateTime.fromFormatParser(trimmed, ZOOM_DATETIME_PARSER, { zone: 'utc' })
   if (parsed.isValid) return parsed.toUTC()
   const fallback = DateTime.fromJSDate(new Date(trimmed))
   return fallback.isValid ? fallback.toUTC() : null
 }
 
 function mergeIntervals(intervals: Interval[]): Interval[] {
-  const filtered = intervals
-    .filter((i) => i.start && i.end && i.end > i.start)
-    .sort((a, b) => a.start.toMillis() - b.start.toMillis())
+  const filtered = intervals.filter((i) => i.end > i.start).sort((a, b) => a.start - b.start)
   if (filtered.length === 0) return []
   const merged: Interval[] = []
   let current = { ...filtered[0] }
-  for (const interval of filtered.slice(1)) {
+  for (let k = 1; k < filtered.length; k++) {
+    const interval = filtered[k]
     if (interval.start <= current.end) {
       if (interval.end > current.end) {
         current.end = interval.end
@@ -211,46 +232,64 @@ function mergeIntervals(intervals: Interval[]): Interval[] {
   return merged
 }
 
-function minutes(intervals: Interval[]): number {
-  return intervals.reduce((acc, i) => acc + i.end.diff(i.start, 'minutes').minutes, 0)
-}
-
 function intervalUnionMinutes(intervals: Interval[]): number {
-  return minutes(mergeIntervals(intervals))
-}
-
-function hasAnyOverlap(intervals: Interval[]): boolean {
-  const filtered = intervals
-    .filter((i) => i.start && i.end && i.end > i.start)
-    .sort((a, b) => a.start.toMillis() - b.start.toMillis())
-  for (let i = 1; i < filtered.length; i++) {
-    if (filtered[i].start < filtered[i - 1].end) {
-      return true
+  const sorted = intervals.filter((i) => i.end > i.start).sort((a, b) => a.start - b.start)
+  if (!sorted.length) return 0
+  let total = 0
+  let start = sorted[0].start
+  let end = sorted[0].end
+  for (let k = 1; k < sorted.length; k++) {
+    const interval = sorted[k]
+    if (interval.start <= end) {
+      if (interval.end > end) end = interval.end
+    } else {
+      total += end - start
+      start = interval.start
+      end = interval.end
     }
   }
-  return false
+  total += end - start
+  return total / MS_PER_MINUTE
 }
 
-function intervalsOverlapOrClose(aIntervals: Interval[], bIntervals: Interval[], maxGapMinutes = 7): boolean {
-  const A = mergeIntervals(aIntervals)
-  const B = mergeIntervals(bIntervals)
+// Both inputs must already be merged (sorted, non-overlapping); see mergeIntervals.
+function intervalsOverlapOrClose(A: Interval[], B: Interval[], maxGapMinutes = 7): boolean {
   if (!A.length || !B.length) return false
+  const gap = maxGapMinutes * MS_PER_MINUTE
+  if (B[0].start - A[A.length - 1].end > gap || A[0].start - B[B.length - 1].end > gap) {
+    return false
+  }
+  const [small, large] = A.length <= B.length ? [A, B] : [B, A]
+  if (large.length >= INTERVAL_SEARCH_MIN) {
+    // Merged ends are sorted too, so the first interval ending after start - gap is the only candidate.
+    for (const a of small) {
+      const from = a.start - gap
+      let lo = 0
+      let hi = large.length
+      while (lo < hi) {
+        const mid = (lo + hi) >> 1
+        if (large[mid].end < from) lo = mid + 1
+        else hi = mid
+      }
+      if (lo < large.length && large[lo].start <= a.end + gap) return true
+    }
+    return false
+  }
   let i = 0
   let j = 0
-  const gap = maxGapMinutes * 60 * 1000
   while (i < A.length && j < B.length) {
     const a = A[i]
     const b = B[j]
     if (a.end >= b.start && b.end >= a.start) {
       return true
     }
-    if (a.end.toMillis() < b.start.toMillis()) {
-      if (b.start.toMillis() - a.end.toMillis() <= gap) {
+    if (a.end < b.start) {
+      if (b.start - a.end <= gap) {
         return true
       }
       i += 1
-    } else if (b.end.toMillis() < a.start.toMillis()) {
-      if (a.start.toMillis() - b.end.toMillis() <= gap) {
+    } else if (b.end < a.start) {
+      if (a.start - b.end <= gap) {
         return true
       }
       j += 1
@@ -263,145 +302,35 @@ function intervalsOverlapOrClose(aIntervals: Interval[], bIntervals: Interval[],
   return false
 }
 
-function minutesMinus(aIntervals: Interval[], bIntervals: Interval[]): number {
-  const A = mergeIntervals(aIntervals)
-  const B = mergeIntervals(bIntervals)
-  if (!A.length) return 0
-  if (!B.length) return minutes(A)
-  let total = 0
-  let j = 0
-  for (const a of A) {
-    let cur = a.start
-    while (cur < a.end && j < B.length) {
-      const b = B[j]
-      if (b.end <= cur) {
-        j += 1
-        continue
-      }
-      if (b.start >= a.end) {
-        break
-      }
-      if (b.start > cur) {
-        total += b.start.diff(cur, 'minutes').minutes
-      }
-      cur = b.end > cur ? b.end : cur
-      if (b.end <= cur) {
-        j += 1
-      }
-    }
-    if (cur < a.end) {
-      total += a.end.diff(cur, 'minutes').minutes
-    }
-  }
-  return total
-}
-
-function tsToExcelString(ts: DateTime | null): string {
-  if (!ts) return ''
-  return ts.toUTC().toFormat('yyyy-MM-dd HH:mm:ss')
+function tsToExcelString(ts: number | null): string {
+  if (ts === null) return ''
+  return new Date(ts).toISOString().slice(0, 19).replace('T', ' ')
 }
 
-function durationToHMS(duration: Duration | null): string {
-  if (!duration) return ''
-  const totalSeconds = Math.max(0, Math.floor(duration.as('seconds')))
+function durationToHMS(durationMs: number | null): string {
+  if (durationMs === null) return ''
+  const totalSeconds = Math.max(0, Math.floor(durationMs / 1000))
   const hrs = Math.floor(totalSeconds / 3600)
-  const rem = totalSeconds % 3600
-  const mins = Math.floor(rem / 60)
-  const secs = rem % 60
-  return `${hrs.toString().padStart(2, '0')}:${mins.toString().padStart(2, '0')}:${secs
-    .toString()
-    .padStart(2, '0')}`
+  const mins = Math.floor((totalSeconds % 3600) / 60)
+  const secs = totalSeconds % 60
+  return `${pad2(hrs)}:${pad2(mins)}:${pad2(secs)}`
 }
 
-function cleanRaw(val: unknown): string {
-  if (val === undefined || val === null) return ''
-  if (typeof val === 'string') return val
-  return String(val ?? '')
+function pad2(value: number): string {
+  return value < 10 ? `0${value}` : String(value)
 }
 
 function canonName(raw: string): string {
   if (typeof raw !== 'string') return ''
+  const cached = canonNameCache.get(raw)
+  if (cached !== undefined) return cached
   let s = raw.toLowerCase()
-  s = s.replace(/\([^)]*\)/g, ' ')
-  s = s.replace(/\d{5}/g, ' ')
-  s = s.replace(/[_-]/g, ' ')
-  s = s.replace(/[^a-z]+/g, ' ')
-  s = s.replace(/\s+/g, ' ').trim()
-  return s
-}
-
-function normNameSpacesOnly(raw: string): string {
-  return String(raw ?? '').trim().toLowerCase().replace(/\s+/g, ' ')
-}
-
-function detectColumns(rows: ZoomRow[]): {
-  nameCol: string
-  joinCol: string | null
-  leaveCol: string | null
-  durationCol: string | null
-  emailCol: string | null
-  pidCol: string | null
-} {
-  if (!rows.length) {
-    throw new Error('Zoom CSV appears to be empty')
-  }
-  const header = Object.keys(rows[0])
-  const lookup = new Map(header.map((h) => [h.toLowerCase(), h]))
-  const pick = (cands: string[]): string | null => {
-    for (const cand of cands) {
-      const found = lookup.get(cand)
-      if (found) return found
-    }
-    return null
-  }
-  const nameCol = pick([
-    'name (original name)',
-    'name',
-    'participant',
-    'user name',
-    'full name',
-    'display name',
-  ])
-  if (!nameCol) {
-    throw new Error(`Could not detect participant name column. Found: ${header.join(', ')}`)
-  }
-  const joinCol = pick([
-    'join time',
-    'join time (timezone)',
-    'join time (yyyy-mm-dd hh:mm:ss)',
-    'join time (utc)',
-    'first join time',
-    'first join time (utc)',
-  ])
-  const leaveCol = pick([
-    'leave time',
-    'leave time (timezone)',
-    'leave time (yyyy-mm-dd hh:mm:ss)',
-    'leave time (utc)',
-    'last leave time',
-    'last leave time (utc)',
-  ])
-  const durationCol = pick([
-    'duration (minutes)',
-    'total duration (minutes)',
-    'time in meeting (minutes)',
-  ])
-  const emailCol = pick(['user email', 'email', 'attendee email'])
-  const pidCol = pick(['participant id', 'user id', 'unique id', 'id'])
-  if (!joinCol && !leaveCol && !durationCol) {
-    throw new Error('No join/leave or duration columns found in the CSV.')
-  }
-  return { nameCol, joinCol, leaveCol, durationCol, emailCol, pidCol }
-}
-
-function parseName(name: string | undefined | null): [string | null, string, number] {
-  if (!name || typeof name !== 'string') return [null, '', -1]
-  const trimmed = name.trim()
-  const match = /^\s*(\d{5})[\s-_]+(.+?)\s*$/.exec(trimmed)
-  if (match) {
-    return [match[1], match[2].trim(), 0]
-  }
-  return [null, trimmed, -1]
+  s = s.replace(PARENTHESISED_RE, ' ')
+  s = s.replace(FIVE_DIGITS_RE, ' ')
+  s = s.replace(SEPARATOR_RE, ' ')
+  s = s.replace(NON_ALPHA_RE, ' ')
+  s = s.replace(WHITESPACE_RE, ' ').trim()
+  return rememberName(canonNameCache, raw, s)
 }
 
 function detectRosterColumns(rows: Record<string, string>[]): {
@@ -412,13 +341,13 @@ function detectRosterColumns(rows: Record<string, string>[]): {
   if (!rows.length) return { erpCol: null, nameCol: null, emailCol: null }
   const header = Object.keys(rows[0])
   const lookup = new Map(header.map((h) => [h.toLowerCase(), h]))
-  const isFiveDigit = (val: string) => /^\s*\d{5}\s*$/.test(val ?? '')
+  const sample = rows.slice(0, 500)
   let bestCol: string | null = null
   let bestHits = -1
   for (const col of header) {
     let hits = 0
-    for (const row of rows.slice(0, 500)) {
-      if (isFiveDigit(String(row[col] ?? ''))) hits += 1
+    for (const row of sample) {
+      if (FIVE_DIGIT_CELL_RE.test(String(row[col] ?? ''))) hits += 1
     }
     if (hits > bestHits) {
       bestHits = hits
@@ -448,10 +377,14 @@ function detectRosterColumns(rows: Record<string, string>[]): {
   return { erpCol, nameCol, emailCol }
 }
 
-async function loadRoster(path: string | null): Promise<RosterRow[]> {
-  if (!path) return []
-  const buf = await fs.readFile(path)
-  const ext = extname(path).toLowerCase()
+function loadRoster(roster: RosterUpload | null): RosterRow[] {
+  if (!roster) return []
+  const buf = roster.data
+  const ext = extname(roster.filename).toLowerCase()
+  return cachedParse(rosterRowsCache, ext, buf, () => parseRoster(buf, ext))
+}
+
+function parseRoster(buf: Buffer, ext: string): RosterRow[] {
   if (ext === '.xlsx' || ext === '.xlsm' || ext === '.xls') {
     const workbook = XLSX.read(buf, { type: 'buffer' })
     const sheetName = workbook.SheetNames[0]
@@ -474,7 +407,7 @@ function normalizeRosterRows(rows: Record<string, string>[]): RosterRow[] {
   const out: RosterRow[] = []
   const seen = new Set<string>()
   for (const row of rows) {
-    const erpMatch = /(\d{5})/.exec(String(row[erpCol] ?? ''))
+    const erpMatch = ERP_IN_CELL_RE.exec(String(row[erpCol] ?? ''))
     const erp = erpMatch ? erpMatch[1] : null
     const name = String(row[nameCol] ?? '').trim()
     if (!erp || !name) continue
@@ -490,21 +423,14 @@ function normalizeRosterRows(rows: Record<string, string>[]): RosterRow[] {
   return out
 }
 
-function shouldExclude(name: string): boolean {
-  for (const pattern of EXCLUDE_NAME_PATTERNS) {
-    if (pattern.test(name ?? '')) return true
-  }
-  return false
-}
-
 function prepareSegments(records: SessionRecord[]): SessionRecord[] {
   const segments = records
     .map((rec) => {
       let start = rec.joinTs
       let end = rec.leaveTs
-      if (!start && end) start = end
-      if (!end && start) end = start
-      if (start && end && end < start) {
+      if (start === null && end !== null) start = end
+      if (end === null && start !== null) end = start
+      if (start !== null && end !== null && end < start) {
         const tmp = start
         start = end
         end = tmp
@@ -515,17 +441,8 @@ function prepareSegments(records: SessionRecord[]): SessionRecord[] {
         leaveTs: end,
       }
     })
-    .filter((rec) => rec.joinTs && rec.leaveTs) as SessionRecord[]
-  segments.sort((a, b) => {
-    const aStart = a.joinTs?.toMillis() ?? 0
-    const bStart = b.joinTs?.toMillis() ?? 0
-    if (aStart === bStart) {
-      const aEnd = a.leaveTs?.toMillis() ?? aStart
-      const bEnd = b.leaveTs?.toMillis() ?? bStart
-      return aEnd - bEnd
-    }
-    return aStart - bStart
-  })
+    .filter((rec) => rec.joinTs !== null && rec.leaveTs !== null)
+  segments.sort((a, b) => (a.joinTs as number) - (b.joinTs as number) || (a.leaveTs as number) - (b.leaveTs as number))
   return segments
 }
 
@@ -537,21 +454,20 @@ function computeReconnectEvents(segments: SessionRecord[]): ReconnectEvent[] {
   let counter = 0
   for (const seg of segments.slice(1)) {
     const start = seg.joinTs ?? seg.leaveTs
-    if (!start) {
-      if (seg.leaveTs && (!coverageEnd || seg.leaveTs > coverageEnd)) {
+    if (start === null) {
+      if (seg.leaveTs !== null && (coverageEnd === null || seg.leaveTs > coverageEnd)) {
         coverageSeg = seg
         coverageEnd = seg.leaveTs
       }
       continue
     }
-    if (!coverageEnd) {
+    if (coverageEnd === null) {
       coverageSeg = seg
       coverageEnd = seg.leaveTs
       continue
     }
-    const toleranceEnd = coverageEnd.plus({ seconds: RECONNECT_OVERLAP_TOLERANCE_SECONDS })
-    if (start < toleranceEnd) {
-      if (seg.leaveTs && (!coverageEnd || seg.leaveTs > coverageEnd)) {
+    if (start < coverageEnd + RECONNECT_OVERLAP_TOLERANCE_MS) {
+      if (seg.leaveTs !== null && seg.leaveTs > coverageEnd) {
         coverageSeg = seg
         coverageEnd = seg.leaveTs
       }
@@ -559,13 +475,12 @@ function computeReconnectEvents(segments: SessionRecord[]): ReconnectEvent[] {
     }
     const disconnectTs = coverageEnd
     const reconnectTs = start
-    const gap = reconnectTs.diff(disconnectTs ?? reconnectTs)
     counter += 1
     events.push({
       index: counter,
       disconnectTs,
       reconnectTs,
-      gap,
+      gapMs: reconnectTs - disconnectTs,
       disconnectSeg: coverageSeg ?? null,
       reconnectSeg: seg ?? null,
     })
@@ -575,13 +490,42 @@ function computeReconnectEvents(segments: SessionRecord[]): ReconnectEvent[] {
   return events
 }
 
+function mergeAggregate(target: KeyAggregates, source: KeyAggregates): void {
+  for (const interval of source.intervals) target.intervals.push(interval)
+  for (const interval of source.goodIntervals) target.goodIntervals.push(interval)
+  for (const interval of source.badIntervals) target.badIntervals.push(interval)
+  for (const dur of source.durationsGood) target.durationsGood.push(dur)
+  for (const dur of source.durationsBad) target.durationsBad.push(dur)
+  for (const rec of source.sessionRecords) target.sessionRecords.push(rec)
+  source.rawNames.forEach((n) => target.rawNames.add(n))
+  target.matchSource = 'alias_merge'
+}
+
+function keyMinutes(aggregate: KeyAggregates, hasTimes: boolean): { good: number; bad: number; segCount: number } {
+  if (hasTimes) {
+    return {
+      good: intervalUnionMinutes(aggregate.goodIntervals),
+      bad: intervalUnionMinutes(aggregate.badIntervals),
+      segCount: aggregate.goodIntervals.length + aggregate.badIntervals.length,
+    }
+  }
+  let good = 0
+  let bad = 0
+  for (const dur of aggregate.durationsGood) good += dur
+  for (const dur of aggregate.durationsBad) bad += dur
+  return { good, bad, segCount: aggregate.durationsGood.length + aggregate.durationsBad.length }
+}
+
+// Row builders are typed against SHEET_COLUMNS so a missing or extra column fails to compile.
+type SheetRow<S extends keyof typeof SHEET_COLUMNS> = Record<(typeof SHEET_COLUMNS)[S][number], any>
+
 interface ProcessedKeySummary {
-  attendanceRows: Record<string, any>[]
-  issuesRows: Record<string, any>[]
-  absentRows: Record<string, any>[]
-  penaltiesRows: Record<string, any>[]
-  matchesRows: Record<string, any>[]
-  reconnectRows: Record<string, any>[]
+  attendanceRows: SheetRow<'Attendance'>[]
+  issuesRows: SheetRow<'Issues'>[]
+  absentRows: SheetRow<'Absent'>[]
+  penaltiesRows: SheetRow<'Penalties'>[]
+  matchesRows: SheetRow<'Matches'>[]
+  reconnectRows: SheetRow<'Reconnects'>[]
   presentErps: Set<string>
   ambiguousNameKeys: Set<string>
   aliasMerges: Array<{ source: string; target: string }>
@@ -613,22 +557,25 @@ function analyseZoom(
   const emailCol = cols.emailCol
   const pidCol = cols.pidCol
 
-  const filteredRows = rows.filter((row) => !shouldExclude(String(row[nameCol] ?? '')))
-  const hasTimes = Boolean(
-    joinCol &&
-      leaveCol &&
-      filteredRows.some((row) => parseDate(row[joinCol!])) &&
-      filteredRows.some((row) => parseDate(row[leaveCol!])),
-  )
+  const sessions: ZoomSession[] = []
+  for (const row of rows) {
+    const rawName = String(row[nameCol] ?? '')
+    if (shouldExclude(rawName)) continue
+    sessions.push({
+      rawName,
+      joinRaw: joinCol ? String(row[joinCol] ?? '') : '',
+      leaveRaw: leaveCol ? String(row[leaveCol] ?? '') : '',
+      duration: durationCol ? Number.parseFloat(String(row[durationCol] ?? '0')) : Number.NaN,
+    })
+  }
+  const joinTimes = joinCol && leaveCol ? sessions.map((s) => parseDate(s.joinRaw)?.toMillis() ?? null) : []
+  const leaveTimes = joinCol && leaveCol ? sessions.map((s) => parseDate(s.leaveRaw)?.toMillis() ?? null) : []
+  const hasTimes = joinTimes.some((ts) => ts !== null) && leaveTimes.some((ts) => ts !== null)
 
   const aggregates = new Map<string, KeyAggregates>()
 
-  const joinValues = hasTimes
-    ? filteredRows.map((row) => parseDate(joinCol ? row[joinCol] : undefined)).filter((dt) => dt) as DateTime[]
-    : []
-  const leaveValues = hasTimes
-    ? filteredRows.map((row) => parseDate(leaveCol ? row[leaveCol] : undefined)).filter((dt) => dt) as DateTime[]
-    : []
+  const joinValues = hasTimes ? joinTimes.filter((ts): ts is number => ts !== null) : []
+  const leaveValues = hasTimes ? leaveTimes.filter((ts): ts is number => ts !== null) : []
 
   let totalMinutes = 0
   let totalSource = ''
@@ -641,14 +588,13 @@ function analyseZoom(
     }
     const minJoin = joinValues.reduce((a, b) => (a < b ? a : b))
     const maxLeave = leaveValues.reduce((a, b) => (a > b ? a : b))
-    totalMinutes = maxLeave.diff(minJoin, 'minutes').minutes
+    totalMinutes = (maxLeave - minJoin) / MS_PER_MINUTE
     totalSource = 'auto (timestamps)'
   } else if (durationCol) {
     let maxDur = 0
-    for (const row of filteredRows) {
-      const num = Number.parseFloat(String(row[durationCol] ?? '0'))
-      if (!Number.isNaN(num) && num > maxDur) {
-        maxDur = num
+    for (const session of sessions) {
+      if (session.duration > maxDur) {
+        maxDur = session.duration
       }
     }
     totalMinutes = maxDur
@@ -664,33 +610,41 @@ function analyseZoom(
   const effectiveThreshold = Math.max(0, thresholdRaw - bufferMinutes)
 
   const reconnectMap = new Map<string, ReconnectEvent[]>()
-
-  for (const row of filteredRows) {
-    const [erp, cleanName, penFlag] = parseName(row[nameCol])
-    const canon = canonName(cleanName)
-    const rawName = String(row[nameCol] ?? '')
-    const key = erp ? `ERP:${erp}` : `NAME:${normNameSpacesOnly(cleanName)}`
-    const aggregate = aggregates.get(key) ?? {
-      key,
-      cleanName,
-      canon,
-      erp,
-      rawNames: new Set<string>(),
-      matchSource: erp ? 'erp_in_name' : 'name_only',
-      intervals: [],
-      goodIntervals: [],
-      badIntervals: [],
-      durationsGood: [],
-      durationsBad: [],
-      sessionRecords: [],
+  const parsedNames = new Map<string, { erp: string | null; cleanName: string; penFlag: number; key: string }>()
+
+  for (let i = 0; i < sessions.length; i++) {
+    const { rawName, joinRaw, leaveRaw, duration } = sessions[i]
+    let parsed = parsedNames.get(rawName)
+    if (!parsed) {
+      const [erp, cleanName, penFlag] = parseName(rawName)
+      parsed = { erp, cleanName, penFlag, key: zoomKey(erp, cleanName) }
+      parsedNames.set(rawName, parsed)
+    }
+    const { erp, cleanName, penFlag, key } = parsed
+    let aggregate = aggregates.get(key)
+    if (!aggregate) {
+      aggregate = {
+        key,
+        cleanName,
+        canon: canonName(cleanName),
+        erp,
+        rawNames: new Set<string>(),
+        matchSource: erp ? 'erp_in_name' : 'name_only',
+        intervals: [],
+        goodIntervals: [],
+        badIntervals: [],
+        durationsGood: [],
+        durationsBad: [],
+        sessionRecords: [],
+      }
+      aggregates.set(key, aggregate)
+    } else if (!aggregate.canon) {
+      aggregate.canon = canonName(cleanName)
     }
     aggregate.rawNames.add(rawName)
     if (erp && !aggregate.erp) aggregate.erp = erp
-    aggregate.canon = aggregate.canon || canon
-    const join = hasTimes && joinCol ? parseDate(row[joinCol]) : null
-    const leave = hasTimes && leaveCol ? parseDate(row[leaveCol]) : null
-    const joinRaw = joinCol ? String(row[joinCol] ?? '') : ''
-    const leaveRaw = leaveCol ? String(row[leaveCol] ?? '') : ''
+    const join = hasTimes ? joinTimes[i] : null
+    const leave = hasTimes ? leaveTimes[i] : null
     const sessionRecord: SessionRecord = {
       joinTs: join,
       leaveTs: leave,
@@ -699,22 +653,22 @@ function analyseZoom(
       rawName,
     }
     aggregate.sessionRecords.push(sessionRecord)
-    if (hasTimes && join && leave) {
-      aggregate.intervals.push({ start: join, end: leave })
+    if (join !== null && leave !== null) {
+      const interval = { start: join, end: leave }
+      aggregate.intervals.push(interval)
       if (penFlag === -1) {
-        aggregate.badIntervals.push({ start: join, end: leave })
+        aggregate.badIntervals.push(interval)
       } else {
-        aggregate.goodIntervals.push({ start: join, end: leave })
+        aggregate.goodIntervals.push(interval)
       }
     } else if (!hasTimes && durationCol) {
-      const dur = Number.parseFloat(String(row[durationCol] ?? '0')) || 0
+      const dur = duration || 0
       if (penFlag === -1) {
         aggregate.durationsBad.push(dur)
       } else {
         aggregate.durationsGood.push(dur)
       }
     }
-    aggregates.set(key, aggregate)
   }
 
   const aliasMerges: Array<{ source: string; target: string }> = []
@@ -736,6 +690,7 @@ function analyseZoom(
     }
   }
 
+  const mergedByKey = new Map<string, Interval[]>()
   for (const [canon, nameKeys] of nameByCanon.entries()) {
     const erpKeys = erpByCanon.get(canon) ?? []
     if (!erpKeys.length) continue
@@ -747,11 +702,16 @@ function analyseZoom(
         if (erpKeys.length === 1) {
           chosen = erpKeys[0]
         } else {
-          const nameIntervals = aggregate.intervals
+          const nameMerged = mergeIntervals(aggregate.intervals)
           for (const erpKey of erpKeys) {
             const erpAgg = aggregates.get(erpKey)
             if (!erpAgg) continue
-            if (intervalsOverlapOrClose(nameIntervals, erpAgg.intervals, 7)) {
+            let erpMerged = mergedByKey.get(erpKey)
+            if (!erpMerged) {
+              erpMerged = mergeIntervals(erpAgg.intervals)
+              mergedByKey.set(erpKey, erpMerged)
+            }
+            if (intervalsOverlapOrClose(nameMerged, erpMerged, 7)) {
               chosen = erpKey
               break
             }
@@ -763,14 +723,8 @@ function analyseZoom(
         }
         const target = aggregates.get(chosen)
         if (!target) continue
-        for (const interval of aggregate.intervals) target.intervals.push(interval)
-        for (const interval of aggregate.goodIntervals) target.goodIntervals.push(interval)
-        for (const interval of aggregate.badIntervals) target.badIntervals.push(interval)
-        for (const dur of aggregate.durationsGood) target.durationsGood.push(dur)
-        for (const dur of aggregate.durationsBad) target.durationsBad.push(dur)
-        for (const rec of aggregate.sessionRecords) target.sessionRecords.push(rec)
-        aggregate.rawNames.forEach((n) => target.rawNames.add(n))
-        target.matchSource = 'alias_merge'
+        mergeAggregate(target, aggregate)
+        mergedByKey.delete(chosen)
         aggregates.delete(nameKey)
         aliasMerges.push({ source: nameKey, target: chosen })
       }
@@ -782,10 +736,7 @@ function analyseZoom(
         for (const nameKey of [...nameKeys]) {
           const aggregate = aggregates.get(nameKey)
           if (!aggregate) continue
-          for (const dur of aggregate.durationsGood) target.durationsGood.push(dur)
-          for (const dur of aggregate.durationsBad) target.durationsBad.push(dur)
-          aggregate.rawNames.forEach((n) => target.rawNames.add(n))
-          target.matchSource = 'alias_merge'
+          mergeAggregate(target, aggregate)
           aggregates.delete(nameKey)
           aliasMerges.push({ source: nameKey, target: targetKey })
         }
@@ -836,26 +787,33 @@ function summarise(
   exemptions: ExemptionsMap,
   hasTimes: boolean,
 ): ProcessedKeySummary {
-  const attendanceRows: Record<string, any>[] = []
-  const issuesRows: Record<string, any>[] = []
-  const absentRows: Record<string, any>[] = []
-  const penaltiesRows: Record<string, any>[] = []
-  const matchesRows: Record<string, any>[] = []
-  const reconnectRows: Record<string, any>[] = []
+  const attendanceRows: SheetRow<'Attendance'>[] = []
+  const issuesRows: SheetRow<'Issues'>[] = []
+  const absentRows: SheetRow<'Absent'>[] = []
+  const penaltiesRows: SheetRow<'Penalties'>[] = []
+  const matchesRows: SheetRow<'Matches'>[] = []
+  const reconnectRows: SheetRow<'Reconnects'>[] = []
   const presentErps = new Set<string>()
 
-  const attHeader = 'Attendance Status'
+  const ceilAttendance = params.rounding_mode === 'ceil_attendance' || params.rounding_mode === 'ceil_both'
+  const thrDecision = params.rounding_mode === 'ceil_both' ? Math.ceil(effectiveThreshold) : effectiveThreshold
+  const thresholdRawRounded = round2(effectiveThreshold)
+  const thrDecisionRounded = round2(thrDecision)
+  const penaltyTolerance = params.penalty_tolerance_minutes
+
+  const mergesByTarget = new Map<string, string[]>()
+  for (const merge of aliasMerges) {
+    const sources = mergesByTarget.get(merge.target) ?? []
+    sources.push(merge.source)
+    mergesByTarget.set(merge.target, sources)
+  }
 
   for (const [key, aggregate] of aggregates.entries()) {
     const erp = aggregate.erp
     const name = aggregate.cleanName
     const zoomNamesRaw = Array.from(aggregate.rawNames).join('; ')
-    const totalGood = hasTimes ? intervalUnionMinutes(aggregate.goodIntervals) : aggregate.durationsGood.reduce((a, b) => a + b, 0)
-    const totalBad = hasTimes ? intervalUnionMinutes(aggregate.badIntervals) : aggregate.durationsBad.reduce((a, b) => a + b, 0)
+    const { good: totalGood, bad: totalBad, segCount } = keyMinutes(aggregate, hasTimes)
     const unionMinutesRaw = Math.min(totalGood + totalBad, adjustedTotal)
-    const segCount = hasTimes
-      ? aggregate.goodIntervals.length + aggregate.badIntervals.length
-      : aggregate.durationsGood.length + aggregate.durationsBad.length
     const isDual = unionMinutesRaw > adjustedTotal + 0.1
     const isReconnect = segCount > 1 && !isDual
     const reconnectCount = isReconnect ? Math.max(0, segCount - 1) : 0
@@ -863,8 +821,8 @@ function summarise(
 
     const events = reconnectMap.get(key) ?? []
     for (const ev of events) {
-      const gapMinutes = Math.round(ev.gap.as('minutes') * 100) / 100
-      const gapSeconds = Math.max(0, Math.round(ev.gap.as('seconds')))
+      const gapMinutes = Math.round((ev.gapMs / MS_PER_MINUTE) * 100) / 100
+      const gapSeconds = Math.max(0, Math.round(ev.gapMs / 1000))
       reconnectRows.push({
         Key: key,
         ERP: erp,
@@ -875,30 +833,24 @@ function summarise(
         'Reconnect Time': tsToExcelString(ev.reconnectTs),
         'Gap (minutes)': gapMinutes,
         'Gap (seconds)': gapSeconds,
-        'Gap Duration (hh:mm:ss)': durationToHMS(ev.gap),
-        'Disconnect Raw Name': cleanRaw(ev.disconnectSeg?.rawName ?? ''),
-        'Reconnect Raw Name': cleanRaw(ev.reconnectSeg?.rawName ?? ''),
-        'Disconnect Join (raw)': cleanRaw(ev.disconnectSeg?.joinRaw ?? ''),
-        'Disconnect Leave (raw)': cleanRaw(ev.disconnectSeg?.leaveRaw ?? ''),
-        'Reconnect Join (raw)': cleanRaw(ev.reconnectSeg?.joinRaw ?? ''),
-        'Reconnect Leave (raw)': cleanRaw(ev.reconnectSeg?.leaveRaw ?? ''),
+        'Gap Duration (hh:mm:ss)': durationToHMS(ev.gapMs),
+        'Disconnect Raw Name': ev.disconnectSeg?.rawName ?? '',
+        'Reconnect Raw Name': ev.reconnectSeg?.rawName ?? '',
+        'Disconnect Join (raw)': ev.disconnectSeg?.joinRaw ?? '',
+        'Disconnect Leave (raw)': ev.disconnectSeg?.leaveRaw ?? '',
+        'Reconnect Join (raw)': ev.reconnectSeg?.joinRaw ?? '',
+        'Reconnect Leave (raw)': ev.reconnectSeg?.leaveRaw ?? '',
       })
     }
 
-    let unionDecision = unionMinutesRaw
-    let thrDecision = effectiveThreshold
-    if (params.rounding_mode === 'ceil_attendance') {
-      unionDecision = Math.ceil(unionDecision)
-    } else if (params.rounding_mode === 'ceil_both') {
-      unionDecision = Math.ceil(unionDecision)
-      thrDecision = Math.ceil(thrDecision)
-    }
+    const unionDecision = ceilAttendance ? Math.ceil(unionMinutesRaw) : unionMinutesRaw
+    const unionRawRounded = round2(unionMinutesRaw)
+    const unionDecisionRounded = round2(unionDecision)
 
     const meets = unionDecision >= thrDecision
     const isAmb = ambiguousNameKeys.has(key)
     const attendanceStatus = isAmb ? 'Needs Review' : meets ? 'Present' : 'Absent'
 
-    const penaltyTolerance = params.penalty_tolerance_minutes
     const badPct = unionMinutesRaw > 0 ? (badOnlyMinutes / unionMinutesRaw) * 100 : 0
     let penaltyApplied = badOnlyMinutes > penaltyTolerance ? -1 : 0
 
@@ -921,20 +873,21 @@ function summarise(
     if (isAmb) {
       issues.push('Ambiguous duplicate name (no ERP / alias ambiguous)')
     }
-    for (const merge of aliasMerges.filter((m) => m.target === key)) {
-      issues.push(`Merged alias ${merge.source} into ${merge.target}`)
+    for (const source of mergesByTarget.get(key) ?? []) {
+      issues.push(`Merged alias ${source} into ${key}`)
     }
+    const issueDetail = issues.join('; ')
 
     attendanceRows.push({
       Key: key,
       'Zoom Names (raw)': zoomNamesRaw,
-      'Attended Minutes (RAW)': round2(unionMinutesRaw),
-      'Threshold Minutes (RAW)': round2(effectiveThreshold),
-      'Attended Minutes (DECISION)': round2(unionDecision),
-      'Threshold Minutes (DECISION)': round2(thrDecision),
-      [attHeader]: attendanceStatus,
+      'Attended Minutes (RAW)': unionRawRounded,
+      'Threshold Minutes (RAW)': thresholdRawRounded,
+      'Attended Minutes (DECISION)': unionDecisionRounded,
+      'Threshold Minutes (DECISION)': thrDecisionRounded,
+      'Attendance Status': attendanceStatus,
       'Naming Penalty': penaltyApplied === -1 ? -1 : 0,
-      Issues: issues.join('; '),
+      Issues: issueDetail,
     })
 
     issuesRows.push({
@@ -943,13 +896,13 @@ function summarise(
       Name: name,
       'Zoom Names (raw)': zoomNamesRaw,
       'Match Source': aggregate.matchSource,
-      'Issue Detail': issues.join('; '),
+      'Issue Detail': issueDetail,
       'Intervals/Segments': segCount,
       'Dual Devices?': isDual ? 'Yes' : 'No',
       'Reconnects?': isReconnect ? 'Yes' : 'No',
       'Reconnect Count': reconnectCount,
       'Ambiguous Name?': isAmb ? 'Yes' : 'No',
-      'Total Minutes Counted (Union RAW)': round2(unionMinutesRaw),
+      'Total Minutes Counted (Union RAW)': unionRawRounded,
       'Override Attendance': '',
     })
 
@@ -960,8 +913,8 @@ function summarise(
         ERP: erp,
         Name: name,
         'Zoom Names (raw)': zoomNamesRaw,
-        'Attended Minutes (DECISION)': round2(unionDecision),
-        'Threshold Minutes (DECISION)': round2(thrDecision),
+        'Attended Minutes (DECISION)': unionDecisionRounded,
+        'Threshold Minutes (DECISION)': thrDecisionRounded,
         'Shortfall Minutes (DECISION)': round2(shortfall),
         'Dual Devices?': isDual ? 'Yes' : 'No',
         'Reconnects?': isReconnect ? 'Yes' : 'No',
@@ -993,25 +946,23 @@ function summarise(
     if (erp) presentErps.add(erp)
   }
 
-  if (rosterRows.length) {
+  const unmatchedRoster = rosterRows.filter((row) => !presentErps.has(row.ERP) && !aggregates.has(`ERP:${row.ERP}`))
+  if (unmatchedRoster.length) {
     const zoomCanonNames = new Set<string>()
     for (const aggregate of aggregates.values()) {
       aggregate.rawNames.forEach((n) => zoomCanonNames.add(canonName(n)))
     }
-    for (const row of rosterRows) {
+    for (const row of unmatchedRoster) {
       const erpKey = `ERP:${row.ERP}`
-      if (presentErps.has(row.ERP)) continue
-      if (aggregates.has(erpKey)) continue
       if (zoomCanonNames.has(row.RosterCanon)) continue
-      const thrDecision = params.rounding_mode === 'ceil_both' ? Math.ceil(effectiveThreshold) : effectiveThreshold
       attendanceRows.push({
         Key: erpKey,
         'Zoom Names (raw)': `${row.RosterName} (roster)`,
         'Attended Minutes (RAW)': 0,
-        'Threshold Minutes (RAW)': round2(effectiveThreshold),
+        'Threshold Minutes (RAW)': thresholdRawRounded,
         'Attended Minutes (DECISION)': 0,
-        'Threshold Minutes (DECISION)': round2(thrDecision),
-        [attHeader]: 'Absent',
+        'Threshold Minutes (DECISION)': thrDecisionRounded,
+        'Attendance Status': 'Absent',
         'Naming Penalty': 0,
         Issues: 'Not in Zoom log (Roster)',
       })
@@ -1036,8 +987,8 @@ function summarise(
         Name: row.RosterName,
         'Zoom Names (raw)': row.RosterName,
         'Attended Minutes (DECISION)': 0,
-        'Threshold Minutes (DECISION)': round2(thrDecision),
-        'Shortfall Minutes (DECISION)': round2(thrDecision),
+        'Threshold Minutes (DECISION)': thrDecisionRounded,
+        'Shortfall Minutes (DECISION)': thrDecisionRounded,
         'Dual Devices?': 'No',
         'Reconnects?': 'No',
         'Reconnect Count': 0,
@@ -1066,26 +1017,26 @@ function round2(value: number): number {
   return Math.round(value * 100) / 100
 }
 
-function createWorksheetFromRows(workbook: Workbook, name: string, rows: Record<string, any>[], columns?: string[]): Worksheet {
-  const worksheet = workbook.addWorksheet(name)
-  const cols = columns ?? (rows.length ? Object.keys(rows[0]) : [])
+type SheetWithColumns = { sheet: Worksheet; columns: readonly string[] }
+
+function createWorksheetFromRows(
+  workbook: Workbook,
+  name: string,
+  rows: Record<string, any>[],
+  columns?: readonly string[],
+): SheetWithColumns {
+  const sheet = workbook.addWorksheet(name)
+  const cols: readonly string[] = columns ?? (rows.length ? Object.keys(rows[0]) : [])
   if (cols.length) {
-    worksheet.columns = cols.map((key) => ({ header: key, key }))
-    for (const row of rows) {
-      worksheet.addRow(cols.map((col) => row[col] ?? ''))
-    }
+    sheet.columns = cols.map((key) => ({ header: key, key }))
+    sheet.addRows(rows.map((row) => cols.map((col) => row[col] ?? '')))
   }
-  return worksheet
+  return { sheet, columns: cols }
 }
 
-function headerNames(sheet: Worksheet): string[] {
-  const headers: string[] = []
-  const firstRow = sheet.getRow(1)
-  firstRow.eachCell({ includeEmpty: true }, (cell, colNumber) => {
-    const value = cell.value
-    headers[colNumber] = value === undefined || value === null ? '' : String((value as any).result ?? value)
-  })
-  return headers
+// 1-based column number for the header, or 0 when the sheet has no such column.
+function columnNumber(columns: readonly string[], header: string): number {
+  return columns.indexOf(header) + 1
 }
 
 async function buildWorkbook(
@@ -1102,29 +1053,22 @@ async function buildWorkbook(
 ): Promise<Buffer> {
   const workbook = new Workbook()
   workbook.creator = 'Zoom Attendance'
-  const rawSheet = workbook.addWorksheet('Raw Zoom CSV')
-  if (rawRows.length) {
-    const headers = Object.keys(rawRows[0])
-    rawSheet.columns = headers.map((h) => ({ header: h, key: h }))
-    for (const row of rawRows) {
-      rawSheet.addRow(headers.map((h) => row[h] ?? ''))
-    }
+  if (params.include_raw) {
+    createWorksheetFromRows(workbook, 'Raw Zoom CSV', rawRows)
   }
 
-  const attendanceSheet = createWorksheetFromRows(workbook, 'Attendance', summary.attendanceRows)
-  const issuesSheet = createWorksheetFromRows(workbook, 'Issues', summary.issuesRows)
-  const reconnectSheet = createWorksheetFromRows(workbook, 'Reconnects', summary.reconnectRows)
-  const absentSheet = createWorksheetFromRows(workbook, 'Absent', summary.absentRows)
-  const penaltiesSheet = createWorksheetFromRows(workbook, 'Penalties', summary.penaltiesRows)
-  const matchesSheet = createWorksheetFromRows(workbook, 'Matches', summary.matchesRows)
+  createWorksheetFromRows(workbook, 'Attendance', summary.attendanceRows, SHEET_COLUMNS.Attendance)
+  const issues = createWorksheetFromRows(workbook, 'Issues', summary.issuesRows, SHEET_COLUMNS.Issues)
+  createWorksheetFromRows(workbook, 'Reconnects', summary.reconnectRows, SHEET_COLUMNS.Reconnects)
+  const absent = createWorksheetFromRows(workbook, 'Absent', summary.absentRows, SHEET_COLUMNS.Absent)
+  const penalties = createWorksheetFromRows(workbook, 'Penalties', summary.penaltiesRows, SHEET_COLUMNS.Penalties)
+  createWorksheetFromRows(workbook, 'Matches', summary.matchesRows, SHEET_COLUMNS.Matches)
   const erpSheet = workbook.addWorksheet('ERPs')
   const erps = rosterRows.length
-    ? Array.from(new Set(rosterRows.map((r) => r.ERP))).sort()
+    ? rosterRows.map((r) => r.ERP).sort()
     : Array.from(summary.presentErps).sort()
   erpSheet.columns = [{ header: 'ERP', key: 'ERP' }]
-  for (const erp of erps) {
-    erpSheet.addRow([erp])
-  }
+  erpSheet.addRows(erps.map((erp) => [erp]))
 
   const metaSheet = workbook.addWorksheet('Meta')
   metaSheet.columns = [
@@ -1141,54 +1085,39 @@ async function buildWorkbook(
     ['Leniency buffer minutes', round2(params.buffer_minutes)],
     ['EFFECTIVE threshold minutes (raw - buffer)', round2(effectiveThreshold)],
     ['Decision rule', 'Present if DECISION Attended >= DECISION Threshold'],
-    [
-      'Rounding mode',
-      {
-        none: 'None',
-        ceil_attendance: 'Ceil attendance only',
-        ceil_both: 'Ceil attendance & threshold',
-      }[params.rounding_mode],
-    ],
+    ['Rounding mode', ROUNDING_MODE_LABELS[params.rounding_mode]],
     ['Naming penalty tolerance (minutes)', params.penalty_tolerance_minutes],
     ['Roster provided', rosterRows.length ? 'Yes' : 'No'],
-    [
-      'Excluded names patterns',
-      EXCLUDE_NAME_PATTERNS.map((re) => re.source.replace(/^\^\s*|\s*\$/g, '')).join('; '),
-    ],
+    ['Excluded names patterns', EXCLUDED_PATTERNS_META],
   ]
-  for (const row of metaRows) metaSheet.addRow(row)
+  metaSheet.addRows(metaRows)
 
   const summarySheet = workbook.addWorksheet('Summary')
   summarySheet.columns = [
     { header: 'Metric', key: 'Metric' },
     { header: 'Value', key: 'Value' },
   ]
-  summarySheet.addRow(['(Formulas inserted by app)', ''])
+  const summaryRows: unknown[][] = [['(Formulas inserted by app)', '']]
 
-  if (issuesSheet.columnCount && summary.issuesRows.length) {
-    const headers = headerNames(issuesSheet)
-    const overrideIndex = headers.indexOf('Override Attendance')
+  const issuesSheet = issues.sheet
+  const absentSheet = absent.sheet
+  if (summary.issuesRows.length) {
+    const overrideIndex = columnNumber(issues.columns, 'Override Attendance')
     if (overrideIndex > 0) {
       for (let r = 2; r <= issuesSheet.rowCount; r++) {
         const cell = issuesSheet.getRow(r).getCell(overrideIndex)
-        cell.dataValidation = {
-          type: 'list',
-          allowBlank: true,
-          formulae: ['"Present,Absent"'],
-        }
+        cell.dataValidation = OVERRIDE_VALIDATION
       }
     }
   }
 
-  if (absentSheet.columnCount && summary.absentRows.length) {
-    const absentHeaders = headerNames(absentSheet)
-    const issuesHeaders = headerNames(issuesSheet)
-    const keyCol = absentHeaders.indexOf('Key')
-    const isAmbCol = absentHeaders.indexOf('Is Ambiguous?')
-    const overrideFromIssuesCol = absentHeaders.indexOf('Override (from Issues)')
-    const finalStatusCol = absentHeaders.indexOf('Final Status')
-    const issuesKeyCol = issuesHeaders.indexOf('Key')
-    const issuesOverrideCol = issuesHeaders.indexOf('Override Attendance')
+  if (summary.absentRows.length) {
+    const keyCol = columnNumber(absent.columns, 'Key')
+    const isAmbCol = columnNumber(absent.columns, 'Is Ambiguous?')
+    const overrideFromIssuesCol = columnNumber(absent.columns, 'Override (from Issues)')
+    const finalStatusCol = columnNumber(absent.columns, 'Final Status')
+    const issuesKeyCol = columnNumber(issues.columns, 'Key')
+    const issuesOverrideCol = columnNumber(issues.columns, 'Override Attendance')
     if (keyCol > 0 && issuesKeyCol > 0 && issuesOverrideCol > 0 && overrideFromIssuesCol > 0 && finalStatusCol > 0) {
       const keyLetter = columnLetter(keyCol)
       const ovLetter = columnLetter(overrideFromIssuesCol)
@@ -1220,56 +1149,61 @@ async function buildWorkbook(
             type: 'expression',
             formulae: [`${finalLetter}2="Needs Review"`],
             priority: 1,
-            style: { fill: { type: 'pattern', pattern: 'solid', fgColor: { argb: 'FFF59D' } } },
+            style: { fill: NEEDS_REVIEW_FILL },
           },
         ],
       })
-      summarySheet.addRow(['Total Absent (final)', { formula: `COUNTIF(Absent!${finalLetter}:${finalLetter},"Absent")` }])
-      summarySheet.addRow(['Total Needs Review', { formula: `COUNTIF(Absent!${finalLetter}:${finalLetter},"Needs Review")` }])
+      summaryRows.push(['Total Absent (final)', { formula: `COUNTIF(Absent!${finalLetter}:${finalLetter},"Absent")` }])
+      summaryRows.push(['Total Needs Review', { formula: `COUNTIF(Absent!${finalLetter}:${finalLetter},"Needs Review")` }])
     }
   } else {
-    summarySheet.addRow(['Total Absent (final)', 0])
-    summarySheet.addRow(['Total Needs Review', 0])
+    summaryRows.push(['Total Absent (final)', 0])
+    summaryRows.push(['Total Needs Review', 0])
   }
 
-  if (penaltiesSheet.columnCount) {
-    const headers = headerNames(penaltiesSheet)
-    const penCol = headers.indexOf('Penalty Applied')
+  if (penalties.columns.length) {
+    const penCol = columnNumber(penalties.columns, 'Penalty Applied')
     if (penCol > 0) {
       const letter = columnLetter(penCol)
-      summarySheet.addRow([
+      summaryRows.push([
         'Total Naming Penalties (-1)',
         { formula: `COUNTIF(Penalties!${letter}:${letter},-1)` },
       ])
     }
   }
 
-  if (issuesSheet.columnCount) {
-    const headers = headerNames(issuesSheet)
-    const dualCol = headers.indexOf('Dual Devices?')
-    const recCol = headers.indexOf('Reconnects?')
-    const ambCol = headers.indexOf('Ambiguous Name?')
+  if (issues.columns.length) {
+    const dualCol = columnNumber(issues.columns, 'Dual Devices?')
+    const recCol = columnNumber(issues.columns, 'Reconnects?')
+    const ambCol = columnNumber(issues.columns, 'Ambiguous Name?')
     if (dualCol > 0) {
       const letter = columnLetter(dualCol)
-      summarySheet.addRow(['Total Dual-Device Flags', { formula: `COUNTIF(Issues!${letter}:${letter},"Yes")` }])
+      summaryRows.push(['Total Dual-Device Flags', { formula: `COUNTIF(Issues!${letter}:${letter},"Yes")` }])
     }
     if (recCol > 0) {
       const letter = columnLetter(recCol)
-      summarySheet.addRow(['Total Reconnect Flags', { formula: `COUNTIF(Issues!${letter}:${letter},"Yes")` }])
+      summaryRows.push(['Total Reconnect Flags', { formula: `COUNTIF(Issues!${letter}:${letter},"Yes")` }])
     }
     if (ambCol > 0) {
       const letter = columnLetter(ambCol)
-      summarySheet.addRow(['Total Ambiguous Names', { formula: `COUNTIF(Issues!${letter}:${letter},"Yes")` }])
+      summaryRows.push(['Total Ambiguous Names', { formula: `COUNTIF(Issues!${letter}:${letter},"Yes")` }])
     }
-    const recCountCol = headers.indexOf('Reconnect Count')
+    const recCountCol = columnNumber(issues.columns, 'Reconnect Count')
     if (recCountCol > 0) {
       const letter = columnLetter(recCountCol)
-      summarySheet.addRow(['Total Reconnect Events', { formula: `SUM(Issues!${letter}:${letter})` }])
+      summaryRows.push(['Total Reconnect Events', { formula: `SUM(Issues!${letter}:${letter})` }])
     }
   }
 
-  const buffer = await workbook.xlsx.writeBuffer()
-  return Buffer.from(buffer)
+  summarySheet.addRows(summaryRows)
+
+  const requestedLevel = Number(params.compress_level)
+  const level = Number.isFinite(requestedLevel) ? Math.min(9, Math.max(0, Math.round(requestedLevel))) : 6
+  const buffer = await workbook.xlsx.writeBuffer({
+    zip: level > 0 ? { compression: 'DEFLATE', compressionOptions: { level } } : { compression: 'STORE' },
+  })
+  // ExcelJS already hands back a Node Buffer here; Buffer.from would copy the whole file.
+  return Buffer.isBuffer(buffer) ? buffer : Buffer.from(buffer)
 }
 
 function columnLetter(index: number): string {
@@ -1284,14 +1218,13 @@ function columnLetter(index: number): string {
 }
 
 export async function processRequest(
-  zoomPath: string,
-  rosterPath: string | null,
+  zoomBuffer: Buffer,
+  roster: RosterUpload | null,
   params: ProcessParams,
   exemptions: ExemptionsMap,
 ): Promise<ProcessPayload> {
-  const rawBuffer = await fs.readFile(zoomPath)
-  const rawRows = normaliseZoom(rawBuffer)
-  const rosterRows = await loadRoster(rosterPath)
+  const rosterRows = loadRoster(roster)
+  const rawRows = normaliseZoom(zoomBuffer)
 
   const processedParams: Required<ProcessParams> = {
     threshold_ratio: params.threshold_ratio ?? 0.8,
@@ -1300,6 +1233,8 @@ export async function processRequest(
     override_total_minutes: params.override_total_minutes ?? null,
     penalty_tolerance_minutes: params.penalty_tolerance_minutes ?? 0,
     rounding_mode: params.rounding_mode ?? 'none',
+    include_raw: params.include_raw ?? false,
+    compress_level: params.compress_level ?? 6,
   }
 
   const analysis = analyseZoom(rawRows, rosterRows, processedParams, exemptions)
@@ -1344,31 +1279,11 @@ export async function processRequest(
       rounding_mode: processedParams.rounding_mode,
       roster_used: rosterRows.length > 0,
       total_class_minutes_source: analysis.totalSource,
+      engine: WRITER_ENGINE,
     },
   }
 }
 
-export async function extractKeysFromCsv(zoomPath: string): Promise<ExtractedKey[]> {
-  const buffer = await fs.readFile(zoomPath)
-  const rows = normaliseZoom(buffer)
-  const cols = detectColumns(rows)
-  const nameCol = cols.nameCol
-  const seen = new Set<string>()
-  const items: ExtractedKey[] = []
-  for (const row of rows) {
-    const name = String(row[nameCol] ?? '')
-    if (shouldExclude(name)) continue
-    const [erp, clean] = parseName(name)
-    const key = erp ? `ERP:${erp}` : `NAME:${normNameSpacesOnly(clean)}`
-    if (seen.has(key)) continue
-    seen.add(key)
-    const displayErp = erp ? `${erp} · ` : ''
-    const display = `${displayErp}${clean}`.trim()
-    items.push({ key, erp, name: clean, display })
-  }
-  return items
-}
-
 export function bufferToBase64(buffer: Buffer): string {
   return buffer.toString('base64')
 }
@@ -5,7 +5,6 @@ import {
   normalisePath,
   notFound,
   optionsResponse,
-  withCors,
 } from './shared.js'
 import { handleHealth, handleKeys, handleProcess } from './handlers.js'
 
@@ -46,11 +45,7 @@ const handler: Handler = async (event) => {
     return notFound()
   } catch (err) {
     const message = err instanceof Error ? err.message : String(err)
-    return withCors({
-      statusCode: 400,
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ error: message }),
-    })
+    return badRequest(message)
   }
 }
 
@@ -1,14 +1,11 @@
 import Busboy from 'busboy'
 import { HandlerEvent, HandlerResponse } from '@netlify/functions'
 import { randomUUID } from 'crypto'
-import { createWriteStream } from 'fs'
-import { promises as fs } from 'fs'
-import { tmpdir } from 'os'
-import { basename, join } from 'path'
+import { gzipSync } from 'zlib'
 
 export interface UploadedFile {
   fieldName: string
-  path: string
+  data: Buffer
   filename: string
   contentType: string
 }
@@ -18,6 +15,15 @@ export interface MultipartResult {
   files: Record<string, UploadedFile>
 }
 
+const MAX_UPLOAD_BYTES = 6 * 1024 * 1024
+
+export function isPayloadTooLarge(event: HandlerEvent): boolean {
+  const declared = Number(event.headers['content-length'] || event.headers['Content-Length'] || 0)
+  const bodyLength = event.body ? event.body.length : 0
+  const received = event.isBase64Encoded ? Math.floor((bodyLength * 3) / 4) : bodyLength
+  return Math.max(declared || 0, received) > MAX_UPLOAD_BYTES
+}
+
 export async function parseMultipart(event: HandlerEvent): Promise<MultipartResult> {
   const contentType = event.headers['content-type'] || event.headers['Content-Type']
   if (!contentType || !contentType.toLowerCase().startsWith('multipart/form-data')) {
@@ -28,7 +34,7 @@ export async function parseMultipart(event: HandlerEvent): Promise<MultipartResu
     const busboy = Busboy({ headers: { 'content-type': contentType } })
     const fields: Record<string, string> = {}
     const files: Record<string, UploadedFile> = {}
-    const writePromises: Promise<void>[] = []
+    const readPromises: Promise<void>[] = []
 
     busboy.on('field', (name, value) => {
       fields[name] = value
@@ -36,28 +42,25 @@ export async function parseMultipart(event: HandlerEvent): Promise<MultipartResu
 
     busboy.on('file', (fieldName, stream, info) => {
       const filename = info.filename || `${fieldName}-${randomUUID()}`
-      const tmpPath = join(tmpdir(), `upload-${Date.now()}-${randomUUID()}-${basename(filename)}`)
-      const outStream = createWriteStream(tmpPath)
-      const record: UploadedFile = {
-        fieldName,
-        path: tmpPath,
-        filename,
-        contentType: info.mimeType || 'application/octet-stream',
-      }
-      const writePromise = new Promise<void>((res, rej) => {
+      const chunks: Buffer[] = []
+      const readPromise = new Promise<void>((res, rej) => {
+        stream.on('data', (chunk: Buffer) => chunks.push(chunk))
         stream.on('error', rej)
-        outStream.on('error', rej)
-        outStream.on('finish', res)
+        stream.on('end', res)
       }).then(() => {
-        files[fieldName] = record
+        files[fieldName] = {
+          fieldName,
+          data: Buffer.concat(chunks),
+          filename,
+          contentType: info.mimeType || 'application/octet-stream',
+        }
       })
-      stream.pipe(outStream)
-      writePromises.push(writePromise)
+      readPromises.push(readPromise)
     })
 
     busboy.on('error', reject)
     busboy.on('finish', () => {
-      Promise.all(writePromises)
+      Promise.all(readPromises)
         .then(() => resolve({ fields, files }))
         .catch(reject)
     })
@@ -66,14 +69,76 @@ export async function parseMultipart(event: HandlerEvent): Promise<MultipartResu
   })
 }
 
-export async function cleanupFiles(files: Iterable<UploadedFile>): Promise<void> {
-  for (const file of files) {
-    try {
-      await fs.unlink(file.path)
-    } catch {
-      /* ignore */
-    }
+const JSON_FIELD_CACHE_SIZE = 128
+const jsonFieldCache = new Map<string, Record<string, any>>()
+
+function deepFreeze<T>(value: T): T {
+  if (value && typeof value === 'object' && !Object.isFrozen(value)) {
+    Object.freeze(value)
+    for (const child of Object.values(value)) deepFreeze(child)
   }
+  return value
+}
+
+export function parseJsonObject(raw: string | undefined): Record<string, any> {
+  if (!raw) return {}
+  const cached = jsonFieldCache.get(raw)
+  if (cached) return cached
+  let result: Record<string, any>
+  try {
+    const parsed = JSON.parse(raw)
+    result = parsed && typeof parsed === 'object' && !Array.isArray(parsed) ? parsed : {}
+  } catch {
+    result = {}
+  }
+  if (jsonFieldCache.size >= JSON_FIELD_CACHE_SIZE) {
+    const oldest = jsonFieldCache.keys().next().value
+    if (oldest !== undefined) jsonFieldCache.delete(oldest)
+  }
+  jsonFieldCache.set(raw, deepFreeze(result))
+  return result
+}
+
+export interface ParseCache<T> {
+  kind: string
+  source: Buffer | null
+  rows: T[]
+}
+
+// Keeps only the last upload, so warm memory holds at most one parsed file per cache. The rows are
+// shared by every invocation that sends the same bytes, so they are frozen before being stored.
+export function cachedParse<T extends object>(
+  cache: ParseCache<T>,
+  kind: string,
+  source: Buffer,
+  build: () => T[],
+): T[] {
+  if (cache.source && cache.kind === kind && cache.source.equals(source)) return cache.rows
+  cache.source = null
+  cache.rows = []
+  const rows = build()
+  for (const row of rows) Object.freeze(row)
+  Object.freeze(rows)
+  cache.kind = kind
+  cache.source = source
+  cache.rows = rows
+  return rows
+}
+
+const NAME_CACHE_SIZE = 4096
+
+export function rememberName(cache: Map<string, string>, raw: string, value: string): string {
+  if (cache.size >= NAME_CACHE_SIZE) cache.clear()
+  cache.set(raw, value)
+  return value
+}
+
+// Header values must be ASCII; escape anything else so the JSON still parses client-side.
+export function headerJson(value: unknown): string {
+  return JSON.stringify(value).replace(
+    /[\u007f-\uffff]/g,
+    (ch) => `\\u${ch.charCodeAt(0).toString(16).padStart(4, '0')}`,
+  )
 }
 
 export function normalisePath(event: HandlerEvent): string {
@@ -115,13 +180,43 @@ export function withCors(response: HandlerResponse): HandlerResponse {
   return { ...response, headers }
 }
 
-export function jsonResponse(statusCode: number, body: unknown): HandlerResponse {
+const GZIP_MIN_BYTES = 1024
+
+// Honours q-values, so `gzip;q=0` (or `*;q=0` without a gzip entry) counts as a refusal.
+function acceptsGzip(acceptEncoding: string): boolean {
+  let wildcardQ = 0
+  for (const entry of acceptEncoding.split(',')) {
+    const [coding, ...params] = entry.split(';').map((part) => part.trim().toLowerCase())
+    const qParam = params.find((param) => param.startsWith('q='))
+    const q = qParam ? Number(qParam.slice(2)) : 1
+    if (coding === 'gzip' || coding === 'x-gzip') return q > 0
+    if (coding === '*') wildcardQ = q
+  }
+  return wildcardQ > 0
+}
+
+export function jsonResponse(statusCode: number, body: unknown, event?: HandlerEvent): HandlerResponse {
+  const payload = JSON.stringify(body)
+  const acceptEncoding = event ? event.headers['accept-encoding'] || event.headers['Accept-Encoding'] || '' : ''
+  if (payload.length >= GZIP_MIN_BYTES && acceptsGzip(acceptEncoding)) {
+    return withCors({
+      statusCode,
+      isBase64Encoded: true,
+      headers: {
+        'Content-Type': 'application/json',
+        'Content-Encoding': 'gzip',
+        Vary: 'Accept-Encoding',
+      },
+      body: gzipSync(payload).toString('base64'),
+    })
+  }
   return withCors({
     statusCode,
     headers: {
       'Content-Type': 'application/json',
+      ...(event ? { Vary: 'Accept-Encoding' } : {}),
     },
-    body: JSON.stringify(body),
+    body: payload,
   })
 }
 
@@ -140,3 +235,7 @@ export function notFound(): HandlerResponse {
 export function badRequest(message: string): HandlerResponse {
   return jsonResponse(400, { error: message })
 }
+
+export function payloadTooLarge(): HandlerResponse {
+  return jsonResponse(413, { error: `Upload exceeds the ${MAX_UPLOAD_BYTES / (1024 * 1024)} MB limit` })
+}
@@ -0,0 +1,220 @@
+import { parse } from 'csv-parse/sync'
+import iconv from 'iconv-lite'
+import { isUtf8 } from 'buffer'
+import { ParseCache, cachedParse, rememberName } from './shared.js'
+
+export const EXCLUDE_NAME_PATTERNS = [
+  /^\s*meeting analytics from read\s*$/i,
+  /^\s*ta\s*$/i,
+  /^\s*saboor'?s fathom notetaker\s*$/i,
+  /^\s*hassaan khalid\s*$/i,
+]
+const EXCLUDE_NAME_RE = new RegExp(EXCLUDE_NAME_PATTERNS.map((re) => `(?:${re.source})`).join('|'), 'i')
+const NAME_ERP_RE = /^\s*(\d{5})[\s-_]+(.+?)\s*$/
+export const WHITESPACE_RE = /\s+/g
+const normNameCache = new Map<string, string>()
+const zoomRowsCache: ParseCache<ZoomRow> = { kind: '', source: null, rows: [] }
+
+export interface ExtractedKey {
+  key: string
+  erp: string | null
+  name: string
+  display: string
+}
+
+export type ZoomRow = Record<string, string>
+
+function decodeBuffer(buffer: Buffer): { text: string; encoding: string } {
+  if (buffer.length === 0) {
+    return { text: '', encoding: 'utf8' }
+  }
+  const first = buffer[0]
+  const second = buffer[1]
+  if (first === 0xff && second === 0xfe) {
+    return { text: iconv.decode(buffer, 'utf16-le'), encoding: 'utf16le' }
+  }
+  if (first === 0xfe && second === 0xff) {
+    return { text: iconv.decode(buffer, 'utf16-be'), encoding: 'utf16be' }
+  }
+  if (buffer.slice(0, 3).equals(Buffer.from([0xef, 0xbb, 0xbf]))) {
+    return { text: iconv.decode(buffer, 'utf8'), encoding: 'utf8-sig' }
+  }
+  if (isUtf8(buffer)) {
+    return { text: iconv.decode(buffer, 'utf8'), encoding: 'utf8' }
+  }
+  return { text: iconv.decode(buffer, 'latin1'), encoding: 'latin1' }
+}
+
+function detectDelimiter(sample: string): string {
+  const candidates = [',', ';', '\t']
+  const lines = sample.split(/\r?\n/, 5)
+  let best = ','
+  let bestScore = -1
+  for (const cand of candidates) {
+    const counts = lines.map((ln) => (ln.includes(cand) ? ln.split(cand).length : 0))
+    const avg = counts.reduce((a, b) => a + b, 0) / (counts.length || 1)
+    if (avg > bestScore) {
+      best = cand
+      bestScore = avg
+    }
+  }
+  return best
+}
+
+export function parseCsv(buffer: Buffer, opts?: { columns?: boolean }): { records: any[]; headers: string[] } {
+  const { text } = decodeBuffer(buffer)
+  return parseCsvText(text, opts)
+}
+
+function parseCsvText(
+  text: string,
+  opts?: { columns?: boolean; delimiter?: string },
+): { records: any[]; headers: string[] } {
+  const delim = opts?.delimiter ?? detectDelimiter(text)
+  const records = parse(text, {
+    columns: opts?.columns ?? true,
+    skip_empty_lines: true,
+    delimiter: delim,
+    relax_column_count: true,
+    trim: true,
+  }) as any[]
+  const headers: string[] = Array.isArray(records) && records.length > 0 ? Object.keys(records[0]) : []
+  return { records, headers }
+}
+
+function parseZoomCsv(buffer: Buffer): ZoomRow[] {
+  const { text } = decodeBuffer(buffer)
+  const headerMatch = /\bName\s*\(original name\)\s*,/i.exec(text)
+  let payload = text
+  let delimiter: string | undefined
+  if (headerMatch) {
+    delimiter = ','
+    const idx = text.lastIndexOf('\n', headerMatch.index)
+    payload = text.slice(idx >= 0 ? idx + 1 : 0)
+  } else {
+    const lines = text.split(/\r?\n/).filter((ln) => ln.trim())
+    let headerIndex = -1
+    for (let i = 0; i < lines.length; i++) {
+      const low = lines[i].toLowerCase()
+      if (low.includes('join time') && low.includes('leave time')) {
+        headerIndex = i
+        break
+      }
+    }
+    if (headerIndex === -1) {
+      throw new Error('Could not locate the participants header row in the CSV.')
+    }
+    payload = lines.slice(headerIndex).join('\n')
+  }
+  const { records } = parseCsvText(payload, { delimiter })
+  return records as ZoomRow[]
+}
+
+export function normaliseZoom(buffer: Buffer): ZoomRow[] {
+  return cachedParse(zoomRowsCache, 'csv', buffer, () => parseZoomCsv(buffer))
+}
+
+function normNameSpacesOnly(raw: string): string {
+  const value = String(raw ?? '')
+  const cached = normNameCache.get(value)
+  if (cached !== undefined) return cached
+  return rememberName(normNameCache, value, value.trim().toLowerCase().replace(WHITESPACE_RE, ' '))
+}
+
+export function zoomKey(erp: string | null, cleanName: string): string {
+  return erp ? `ERP:${erp}` : `NAME:${normNameSpacesOnly(cleanName)}`
+}
+
+export function detectColumns(rows: ZoomRow[]): {
+  nameCol: string
+  joinCol: string | null
+  leaveCol: string | null
+  durationCol: string | null
+  emailCol: string | null
+  pidCol: string | null
+} {
+  if (!rows.length) {
+    throw new Error('Zoom CSV appears to be empty')
+  }
+  const header = Object.keys(rows[0])
+  const lookup = new Map(header.map((h) => [h.toLowerCase(), h]))
+  const pick = (cands: string[]): string | null => {
+    for (const cand of cands) {
+      const found = lookup.get(cand)
+      if (found) return found
+    }
+    return null
+  }
+  const nameCol = pick([
+    'name (original name)',
+    'name',
+    'participant',
+    'user name',
+    'full name',
+    'display name',
+  ])
+  if (!nameCol) {
+    throw new Error(`Could not detect participant name column. Found: ${header.join(', ')}`)
+  }
+  const joinCol = pick([
+    'join time',
+    'join time (timezone)',
+    'join time (yyyy-mm-dd hh:mm:ss)',
+    'join time (utc)',
+    'first join time',
+    'first join time (utc)',
+  ])
+  const leaveCol = pick([
+    'leave time',
+    'leave time (timezone)',
+    'leave time (yyyy-mm-dd hh:mm:ss)',
+    'leave time (utc)',
+    'last leave time',
+    'last leave time (utc)',
+  ])
+  const durationCol = pick([
+    'duration (minutes)',
+    'total duration (minutes)',
+    'time in meeting (minutes)',
+  ])
+  const emailCol = pick(['user email', 'email', 'attendee email'])
+  const pidCol = pick(['participant id', 'user id', 'unique id', 'id'])
+  if (!joinCol && !leaveCol && !durationCol) {
+    throw new Error('No join/leave or duration columns found in the CSV.')
+  }
+  return { nameCol, joinCol, leaveCol, durationCol, emailCol, pidCol }
+}
+
+export function parseName(name: string | undefined | null): [string | null, string, number] {
+  if (!name || typeof name !== 'string') return [null, '', -1]
+  const trimmed = name.trim()
+  const match = NAME_ERP_RE.exec(trimmed)
+  if (match) {
+    return [match[1], match[2].trim(), 0]
+  }
+  return [null, trimmed, -1]
+}
+
+export function shouldExclude(name: string): boolean {
+  return EXCLUDE_NAME_RE.test(name ?? '')
+}
+
+export function extractKeysFromCsv(buffer: Buffer): ExtractedKey[] {
+  const rows = normaliseZoom(buffer)
+  const cols = detectColumns(rows)
+  const nameCol = cols.nameCol
+  const seen = new Set<string>()
+  const items: ExtractedKey[] = []
+  for (const row of rows) {
+    const name = String(row[nameCol] ?? '')
+    if (shouldExclude(name)) continue
+    const [erp, clean] = parseName(name)
+    const key = zoomKey(erp, clean)
+    if (seen.has(key)) continue
+    seen.add(key)
+    const displayErp = erp ? `${erp} · ` : ''
+    const display = `${displayErp}${clean}`.trim()
+    items.push({ key, erp, name: clean, display })
+  }
+  return items
+}